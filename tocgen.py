@@ -20,13 +20,10 @@ import enum
 import os.path
 import re
 import sys
-from collections import defaultdict
 from collections.abc import Iterable
 from collections.abc import Iterator
 from dataclasses import dataclass
-from html import escape
 from html.parser import HTMLParser
-from itertools import groupby
 from types import SimpleNamespace
 from typing import Optional  # noqa
 from typing import Protocol
@@ -42,13 +39,26 @@ class OutputFormatExtension(enum.Enum):
     html = '.html'
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TocEntry:
     depth: int
     heading: str
     link: str
 
 
+def _read_text(filename: str) -> str:
+    """
+    Read a whole UTF-8 file in one call, bypassing the text I/O layer. Line
+    endings are normalized to ``\\n`` as in universal newlines mode, but only
+    when the file actually contains carriage returns.
+    """
+    with open(filename, 'rb') as fh:
+        text = fh.read().decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
 class DocumentParser(Protocol):
     """
     Interface for parsing document headings into a collection of entries.
@@ -75,11 +85,9 @@ class SimpleHtmlParser(HTMLParser, DocumentParser):
     """
     entries: list[TocEntry]
     _depth: int
-    _heading: str
+    _heading_parts: list[str]
     _link: str
 
-    RE_HEADING = re.compile(r'^h(\d+)$', re.I)
-
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._reset()
@@ -90,32 +98,31 @@ class SimpleHtmlParser(HTMLParser, DocumentParser):
 
     def _resetTagVariables(self):
         self._in_heading_tag = False
-        self._heading = ''
+        self._heading_parts = []
 
     def handle_starttag(self, tag, attrs):
-        if not self._in_heading_tag and (h := self.RE_HEADING.match(tag)):
+        # Plain string checks for ``hN`` tags avoid a regex call per tag
+        if (not self._in_heading_tag and tag[:1] in ('h', 'H')
+                and (level := tag[1:]).isdigit() and level.isascii()):
             self._in_heading_tag = True
-            self._depth = int(h.group(1)) - 1
-            for name, value in attrs:
-                if name == 'id':
-                    self._link = f'#{value}'
-                    break
-            else:
-                self._link = ''
+            self._depth = int(level) - 1
+            self._link = next(
+                (f'#{value}' for name, value in attrs if name == 'id'), '')
 
     def handle_endtag(self, tag):
-        if self._in_heading_tag and self.RE_HEADING.match(tag):
-            self.entries.append(TocEntry(self._depth, self._heading, self._link))
+        if (self._in_heading_tag and tag[:1] in ('h', 'H')
+                and (level := tag[1:]).isdigit() and level.isascii()):
+            heading = ''.join(self._heading_parts).replace('\n', '')
+            self.entries.append(TocEntry(self._depth, heading, self._link))
             self._resetTagVariables()
 
     def handle_data(self, data):
         if self._in_heading_tag:
-            self._heading += data.replace('\n', '')
+            self._heading_parts.append(data)
 
     def parseFile(self, infile) -> list[TocEntry]:
         self._reset()
-        with open(infile, 'rt') as fh:
-            self.feed(fh.read())
+        self.feed(_read_text(infile))
         return self.entries
 
 
@@ -125,51 +132,74 @@ class SimpleMarkdownParser(DocumentParser):
     (*e. g.*, ``## Foo``, ``### Bar``) in a Markdown document. Note that top
     level headings (``# Main title``) will be ignored.
     """
-    FENCE = '```'
-    RE_CAPTURE = re.compile('^(#+)(.*)$')
+    RE_SCAN = re.compile(r'^(?:(```)|(#+)(.*))', flags=re.M)
+    RE_FENCE = re.compile(r'^```', flags=re.M)
     RE_HTML_COMMENT = re.compile(r'<!--.*?-->', flags=re.S)  # Non-greedy match
-    RE_SPECIALS = re.compile(r'''[!@#$%^&*()+;:'"\[\]{}|\\<>,./?`~]''')
-    RE_CUSTOM_ID = re.compile(r'''(.*?)\s*\{(#.+?)}''')
+    # Maps spaces to dashes and deletes punctuation when deriving anchor links
+    SLUG_SPECIALS = r'''!@#$%^&*()+;:'"[]{}|\<>,./?`~'''
+    SLUG_TABLE = str.maketrans(' ', '-', SLUG_SPECIALS)
+    # Same mapping, plus lowercasing, as a byte table for ASCII-only headings
+    ASCII_SLUG_TABLE = bytes.maketrans(b' ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                                       b'-abcdefghijklmnopqrstuvwxyz')
+    ASCII_SLUG_DELETE = SLUG_SPECIALS.encode('ascii')
+    # Compiled per parse only when custom anchors are enabled; repeat
+    # compilations are served from the re module's cache
+    PATTERN_CUSTOM_ID = r'''(.*?)\s*\{(#.+?)}'''
 
     def __init__(self, *, use_custom_anchors=False):
         self.use_custom_anchors = use_custom_anchors
 
-    def _openWithStrippedHtmlComments(self, filename: str) -> Iterator[str]:
-        with open(filename) as f:
-            yield from self.RE_HTML_COMMENT.sub('', f.read()).split('\n')
-
     def _deriveLinkFromHeading(self, heading, links):
-        link = self.RE_SPECIALS.sub('', heading.lower().replace(' ', '-'))
-        links[link] += 1
-        if n_links := links[link] - 1:
-            link = f'{link}-{str(n_links)}'
-        return f'#{escape(link)}'
+        if heading.isascii():
+            link = heading.encode('ascii').translate(
+                self.ASCII_SLUG_TABLE, self.ASCII_SLUG_DELETE).decode('ascii')
+        else:
+            link = heading.lower().translate(self.SLUG_TABLE)
+        n_links = links.get(link, 0)
+        links[link] = n_links + 1
+        if n_links:
+            link = f'{link}-{n_links}'
+        # The slug cannot contain any of the characters html.escape replaces,
+        # since they are all in SLUG_SPECIALS.
+        return f'#{link}'
 
     def parseFile(self, infile) -> list[TocEntry]:
-        in_fence = False
-        links: dict[str, int] = defaultdict(int)
+        links: dict[str, int] = {}
         entries = []
 
-        for line in self._openWithStrippedHtmlComments(infile):
-            if line.startswith(self.FENCE):
-                in_fence = not in_fence
+        # Bind loop invariants to locals to skip attribute lookups per match
+        scan = self.RE_SCAN.search
+        find_fence = self.RE_FENCE.search
+        custom_id = (re.compile(self.PATTERN_CUSTOM_ID).match
+                     if self.use_custom_anchors else None)
+        derive_link = self._deriveLinkFromHeading
+        stderr_write = sys.stderr.write
+
+        # Only fence and heading lines are matched; the regex engine skips the
+        # rest of the document without returning to Python. An opening fence
+        # jumps straight past its closing fence, so code blocks are skipped
+        # whole.
+        text = self.RE_HTML_COMMENT.sub('', _read_text(infile))
+        pos = 0
+        while m := scan(text, pos):
+            pos = m.end()
+            if m.group(1):
+                if not (m := find_fence(text, pos)):
+                    break  # An unclosed fence runs to the end of the document
+                pos = m.end()
                 continue
 
-            if in_fence or not (m := self.RE_CAPTURE.match(line)):
-                continue
-
-            depth = len(m.group(1)) - 2
-            heading = m.group(2).strip()
+            depth = len(m.group(2)) - 2
+            heading = m.group(3).strip()
             if depth < 0:
-                sys.stderr.write(f'Top level headings are ignored. '
-                                 f'Skipping {heading}\n')
+                stderr_write(f'Top level headings are ignored. '
+                             f'Skipping {heading}\n')
                 continue
 
-            if (self.use_custom_anchors
-                    and (m := self.RE_CUSTOM_ID.match(heading))):
+            if custom_id and (m := custom_id(heading)):
                 heading, link = m.groups()
             else:
-                link = self._deriveLinkFromHeading(heading, links)
+                link = derive_link(heading, links)
 
             entries.append(TocEntry(depth, heading, link))
 
@@ -199,21 +229,51 @@ class BaseTocGenerator(abc.ABC):
     """
 
     def __init__(self, entries, indent=4, outfile=None):
-        self.entries = entries
+        # Generators scan the entries more than once, so materialize them
+        self.entries = list(entries)
         self.indent = indent
         self.indent_str = indent * ' '
         self.outfile = outfile
 
+    def _padsByDepth(self, extra=0) -> list[str]:
+        """
+        Precompute the indentation for every depth present in the entries so
+        it can be looked up rather than rebuilt for each entry.
+
+        :param extra: Number of levels to add beyond the deepest entry.
+        """
+        max_depth = max((entry.depth for entry in self.entries), default=0)
+        return [i * self.indent_str for i in range(max_depth + 1 + extra)]
+
+    def _streamsLines(self) -> bool:
+        """
+        Whether :meth:`generateLines` is the most derived way to produce the
+        output. A subclass that overrides only :meth:`generateString` below
+        the class defining :meth:`generateLines` must have that override
+        honored by :meth:`write`.
+        """
+        for cls in type(self).__mro__:
+            if 'generateLines' in cls.__dict__:
+                return True
+            if 'generateString' in cls.__dict__:
+                return False
+        return False
+
     def write(self):
         """
-        Write the Table of Contents to file or STDOUT.
+        Write the Table of Contents to file or STDOUT. Lines are written as
+        they are generated rather than joined into one string first, unless
+        a subclass customizes only :meth:`generateString`.
         """
-        s = self.generateString()
+        if self._streamsLines():
+            lines = (f'{line}\n' for line in self.generateLines())
+        else:
+            lines = (self.generateString(), '\n')
         if self.outfile:
             with open(self.outfile, 'wt') as fh:
-                fh.write(s + '\n')
+                fh.writelines(lines)
         else:
-            print(s)
+            sys.stdout.writelines(lines)
 
     @abc.abstractmethod
     def generateString(self) -> str:
@@ -222,19 +282,30 @@ class BaseTocGenerator(abc.ABC):
         """
         raise NotImplementedError
 
+    def generateLines(self) -> Iterator[str]:
+        """
+        Generate the lines of the Table of Contents, without line endings.
+        Subclasses may override this to stream their output; by default the
+        lines are split out of :meth:`generateString`.
+        """
+        yield from self.generateString().split('\n')
+
 
 class MarkdownTocGenerator(BaseTocGenerator):
 
     def generateString(self) -> str:
-        lines = ['## Table of Contents', '']
+        return '\n'.join(self.generateLines())
+
+    def generateLines(self) -> Iterator[str]:
+        yield '## Table of Contents'
+        yield ''
+        pads = self._padsByDepth()
         for entry in self.entries:
-            pad = entry.depth * self.indent_str
+            pad = pads[entry.depth]
             if entry.link:
-                heading_str = f'[{entry.heading}]({entry.link})'
+                yield f'{pad}* [{entry.heading}]({entry.link})'
             else:
-                heading_str = entry.heading
-            lines.append(f'{pad}* {heading_str}')
-        return '\n'.join(lines)
+                yield f'{pad}* {entry.heading}'
 
 
 class HtmlTagGenerator(SimpleNamespace):
@@ -292,31 +363,55 @@ class HtmlTagGenerator(SimpleNamespace):
         return html_tag
 
 
-_wrapInTag = HtmlTagGenerator(['h2', 'ul', 'li', 'a'])
+# Fixed-shape tag helpers for HtmlTocGenerator's per-entry hot path. The
+# general purpose HtmlTagGenerator handles arbitrary tags and options.
+def _h2(content: str) -> str:
+    return f'<h2>{content}</h2>'
+
+
+def _li(content: str) -> str:
+    return f'<li>{content}</li>'
+
+
+def _a(content: str, href: str) -> str:
+    return f'<a href="{href}">{content}</a>'
 
 
 class HtmlTocGenerator(BaseTocGenerator):
 
     def generateString(self) -> str:
-        return (_wrapInTag.h2('Table of Contents') + '\n' +
-                self._generateUlStr(self.entries, 0))
+        return '\n'.join(self.generateLines())
 
-    def _generateUlStr(self, entries: Iterable[TocEntry], depth: int) -> str:
+    def generateLines(self) -> Iterator[str]:
+        yield _h2('Table of Contents')
+        yield from self._generateUlLines()
+
+    def _generateUlLines(self) -> Iterator[str]:
         """
-        Generate a string containing potentially nested unordered list
-        (``<ul>``) nodes from a list of TOC entries.
+        Generate the lines of potentially nested unordered list (``<ul>``)
+        nodes from the TOC entries. Nested lists are opened and closed in a
+        single pass as the depth of the entries changes.
         """
-        output = []
-        groups = groupby(entries, lambda x: x.depth == depth)
-        for is_same_depth, entry_group in groups:
-            if is_same_depth:
-                for entry in entry_group:
-                    li = _wrapInTag.li(self._maybeWrapInLink(entry))
-                    output.append((1 + depth) * self.indent_str + li)
-            else:
-                output.append(self._generateUlStr(entry_group, depth + 1))
-        return _wrapInTag.ul(
-            '\n'.join(output), newline=True, indent=depth * self.indent_str)
+        pads = self._padsByDepth(extra=1)
+        maybe_wrap_in_link = self._maybeWrapInLink
+        wrap_in_li = _li
+        yield '<ul>'
+        depth = 0
+        for entry in self.entries:
+            entry_depth = entry.depth
+            while depth < entry_depth:
+                depth += 1
+                yield pads[depth] + '<ul>'
+            while depth > entry_depth:
+                yield pads[depth] + '</ul>'
+                depth -= 1
+            yield pads[1 + depth] + wrap_in_li(maybe_wrap_in_link(entry))
+        while depth > 0:
+            yield pads[depth] + '</ul>'
+            depth -= 1
+        if not self.entries:
+            yield ''  # An empty list still has a blank line between its tags
+        yield '</ul>'
 
     @staticmethod
     def _maybeWrapInLink(entry: TocEntry) -> str:
@@ -324,10 +419,7 @@ class HtmlTocGenerator(BaseTocGenerator):
         Create a string out of a TOC entry. If the entry contains a non-empty
         link attribute, it will be wrapped in an anchor tag (``<a>``).
         """
-        if entry.link:
-            attrs = [('href', entry.link)]
-            return _wrapInTag.a(entry.heading, attrs=attrs)
-        return entry.heading
+        return _a(entry.heading, entry.link) if entry.link else entry.heading
 
 
 def parse_args(argv=None):